@@ -1,94 +1,210 @@
 import socket
+import selectors
 import json
 import time
 import random
-import threading
+import struct
+import msgspec
+
+_enc = msgspec.json.Encoder()
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg") # POSIX only
+# Channel keys in MPUChannel bit order (bit 0 = accel_x ... bit 8 = magn_z)
+CHANNEL_KEYS = (
+    "accel_x", "accel_y", "accel_z",
+    "anglvel_x", "anglvel_y", "anglvel_z", # gyro
+    "magn_x", "magn_y", "magn_z",
+)
+# config_channels names -> bits, including the *_xyz groups
+_NAME_BITS = {k: 1 << i for i, k in enumerate(CHANNEL_KEYS)}
+for _group in ("accel", "anglvel", "magn"):
+    _NAME_BITS[f"{_group}_xyz"] = sum(b for k, b in _NAME_BITS.items() if k.startswith(_group + "_"))
+ALL_MASK = (1 << len(CHANNEL_KEYS)) - 1
+# Binary frame: channel count n + uint16 channel mask + n float32, all little-endian
+_FRAMES = {n: struct.Struct(f"<BH{n}f") for n in range(1, len(CHANNEL_KEYS) + 1)}
+
+def config_mask(cmd):
+    """Channel mask selected by a config_channels command, given either names or an integer mask"""
+    mask = cmd.get('mask')
+    if not isinstance(mask, int):
+        mask = 0
+        for name in cmd.get('params') or []:
+            mask |= _NAME_BITS.get(str(name).lower().replace("gyro", "anglvel"), 0)
+    return mask & ALL_MASK
+
+def send_parts(conn, parts):
+    """Send the parts with one scatter-gather syscall; returns the bytes written, 0 if the socket buffer is full"""
+    try:
+        if _HAS_SENDMSG:
+            return conn.sendmsg(parts)
+        return conn.send(b"".join(parts))
+    except BlockingIOError:
+        return 0
 
 class MockServer:
-    def __init__(self, host='0.0.0.0', port=8888):
+    def __init__(self, host='0.0.0.0', port=8888, interval=0.01):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((host, port))
         self.server_socket.listen(1)
+        self.server_socket.setblocking(False)
+        # Single selector drives accept, command reads and streaming for every client
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.server_socket, selectors.EVENT_READ, None)
+        self.interval = interval
         self.running = True
-        self.clients = []
+        self.clients = {}
+        # Reused for every sample; values are overwritten in place
+        self.packet = dict.fromkeys(CHANNEL_KEYS, 0.0)
         print(f"Mock Server listening on {host}:{port}")
 
     def run(self):
-        threading.Thread(target=self.accept_clients, daemon=True).start()
+        next_send = time.monotonic() + self.interval
         try:
             while self.running:
-                time.sleep(1)
+                timeout = max(0.0, next_send - time.monotonic())
+                for key, events in self.sel.select(timeout=timeout):
+                    if key.data is None:
+                        self.accept_client()
+                        continue
+                    if events & selectors.EVENT_WRITE:
+                        self.flush_client(key.fileobj, key.data)
+                    if events & selectors.EVENT_READ and key.fileobj in self.clients:
+                        self.handle_client(key.fileobj, key.data)
+
+                now = time.monotonic()
+                if now >= next_send:
+                    self.send_samples()
+                    # Advance from the previous deadline so the rate does not drift,
+                    # but resync instead of bursting if we fell a whole tick behind
+                    next_send += self.interval
+                    if next_send < now:
+                        next_send = now + self.interval
         except KeyboardInterrupt:
             self.stop()
 
-    def accept_clients(self):
-        while self.running:
-            try:
-                conn, addr = self.server_socket.accept()
-                print(f"Connected by {addr}")
-                self.clients.append(conn)
-                threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
-            except OSError:
-                break
+    def accept_client(self):
+        try:
+            conn, addr = self.server_socket.accept()
+        except BlockingIOError:
+            return
+        print(f"Connected by {addr}")
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # "out" holds the unsent tail of a partially written sample
+        # "mask" only applies to binary frames; JSON samples always carry every channel
+        state = {"streaming": False, "binary": False, "mask": ALL_MASK, "buffer": b"", "out": b""}
+        self.clients[conn] = state
+        self.sel.register(conn, selectors.EVENT_READ, state)
 
-    def handle_client(self, conn):
-        streaming = False
+    def handle_client(self, conn, state):
         try:
-            while self.running:
-                # Basic non-blocking check or loop
-                conn.settimeout(0.1)
+            data = conn.recv(1024)
+            if not data:
+                self.remove_client(conn)
+                return
+
+            # Process commands; keep bytes until a full line arrives so a
+            # multibyte character split across reads still decodes
+            state["buffer"] += data
+            while b"\n" in state["buffer"]:
+                line, state["buffer"] = state["buffer"].split(b"\n", 1)
                 try:
-                    data = conn.recv(1024)
-                    if not data:
-                        break
-                    
-                    # Process commands
-                    buffer = data.decode('utf-8')
-                    while "\n" in buffer:
-                        line, buffer = buffer.split("\n", 1)
-                        try:
-                            cmd = json.loads(line)
-                            print(f"Received: {cmd}")
-                            if cmd['action'] == 'start_send':
-                                streaming = True
-                            elif cmd['action'] == 'stop_send':
-                                streaming = False
-                            elif cmd['action'] == 'disconnect':
-                                return # Close connection
-                        except json.JSONDecodeError:
-                            pass
-                except socket.timeout:
-                    pass
+                    cmd = json.loads(line)
+                except ValueError: # JSONDecodeError or UnicodeDecodeError
+                    continue
+                if not isinstance(cmd, dict):
+                    continue
+                print(f"Received: {cmd}")
+                action = cmd.get('action')
+                if action == 'start_send':
+                    state["streaming"] = True
+                elif action == 'stop_send':
+                    state["streaming"] = False
+                elif action == 'config_channels':
+                    state["mask"] = config_mask(cmd)
+                elif action == 'set_format':
+                    params = cmd.get('params') or []
+                    state["binary"] = bool(params) and str(params[0]).lower() == 'binary'
+                elif action == 'disconnect':
+                    self.remove_client(conn) # Close connection
+                    return
+        except Exception as e:
+            # Any failure only drops this client, never the whole server
+            print(f"Client error: {e!r}")
+            self.remove_client(conn)
+
+    def flush_client(self, conn, state):
+        """Finish a partially written sample once the socket is writable again"""
+        try:
+            sent = conn.send(state["out"])
+        except BlockingIOError:
+            return
+        except OSError:
+            self.remove_client(conn)
+            return
+        state["out"] = state["out"][sent:]
+        if not state["out"]:
+            self.sel.modify(conn, selectors.EVENT_READ, state)
+
+    def send_samples(self):
+        streaming = [(conn, state) for conn, state in self.clients.items() if state["streaming"]]
+        if not streaming:
+            return
+
+        # Construct dummy data based on MPUChannel names
+        # JSON samples send everything for simplicity, the client filters normally,
+        # but binary frames are fixed-layout and follow each client's config_channels.
+        r = random.random
+        packet = self.packet
+        packet["accel_x"] = r() * 4 - 2
+        packet["accel_y"] = r() * 4 - 2
+        packet["accel_z"] = r() * 4 - 2
+        packet["anglvel_x"] = r() * 500 - 250
+        packet["anglvel_y"] = r() * 500 - 250
+        packet["anglvel_z"] = r() * 500 - 250
+        packet["magn_x"] = r() * 100 - 50
+        packet["magn_y"] = r() * 100 - 50
+        packet["magn_z"] = r() * 100 - 50
+        parts = [_enc.encode(packet), b'\n']
+        frames = {}
+        for conn, state in streaming:
+            if state["out"]:
+                continue # Still flushing the previous sample, drop this one
+            if state["binary"]:
+                mask = state["mask"]
+                if not mask:
+                    continue
+                payload = frames.get(mask)
+                if payload is None:
+                    keys = [k for i, k in enumerate(CHANNEL_KEYS) if mask & (1 << i)]
+                    payload = frames[mask] = [_FRAMES[len(keys)].pack(len(keys), mask, *[packet[k] for k in keys])]
+            else:
+                payload = parts
+            try:
+                sent = send_parts(conn, payload)
+            except OSError:
+                self.remove_client(conn)
+                continue
+            total = sum(len(p) for p in payload)
+            if 0 < sent < total:
+                # Part of the sample is already on the wire; finish it before sending more
+                state["out"] = b"".join(payload)[sent:]
+                self.sel.modify(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, state)
+            # sent == 0: client is not keeping up, drop this sample
 
-                if streaming:
-                    # Construct dummy data based on MPUChannel names
-                    # We send everything for simplicity, the client filters normally, 
-                    # but here let's just send a full set.
-                    data_packet = {
-                        "accel_x": random.uniform(-2, 2),
-                        "accel_y": random.uniform(-2, 2),
-                        "accel_z": random.uniform(-2, 2),
-                        "anglvel_x": random.uniform(-250, 250), # gyro
-                        "anglvel_y": random.uniform(-250, 250),
-                        "anglvel_z": random.uniform(-250, 250),
-                        "magn_x": random.uniform(-50, 50),
-                        "magn_y": random.uniform(-50, 50),
-                        "magn_z": random.uniform(-50, 50),
-                    }
-                    payload = json.dumps(data_packet).encode('utf-8') + b'\n'
-                    conn.sendall(payload)
-                    time.sleep(0.1) 
-        except (ConnectionResetError, BrokenPipeError):
-            pass
-        finally:
-            print("Client disconnected")
-            if conn in self.clients:
-                self.clients.remove(conn)
-            conn.close()
+    def remove_client(self, conn):
+        if conn not in self.clients:
+            return
+        print("Client disconnected")
+        del self.clients[conn]
+        self.sel.unregister(conn)
+        conn.close()
 
     def stop(self):
         self.running = False
+        for conn in list(self.clients):
+            self.remove_client(conn)
+        self.sel.close()
         self.server_socket.close()
 
 if __name__ == '__main__':
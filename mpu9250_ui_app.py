@@ -3,6 +3,7 @@ import socket
 import json
 import threading
 import time
+import msgspec
 from PySide6.QtWidgets import QApplication, QMainWindow, QMessageBox
 from PySide6.QtCore import QObject, Signal, Slot, QThread
 
@@ -20,8 +21,14 @@ class MPUModel(QObject):
         self._socket = None
         self._running = False
         self._thread = None
+        self._decoder = msgspec.json.Decoder(dict)
+        # Receive buffer reused for every recv_into; lines are parsed in place
+        self._rxbuf = bytearray(65536)
+        self._rxlen = 0
         self.ip = "127.0.0.1"
         self.port = 8888
+        # Coalesce incoming samples so the UI thread sees at most ~30 updates/s
+        self.update_interval = 1 / 30
 
     def connect_server(self, ip, port):
         if self._running:
@@ -68,30 +75,56 @@ class MPUModel(QObject):
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self._socket.settimeout(5.0) # Connection timeout
             self._socket.connect((self.ip, self.port))
-            self._socket.settimeout(None) # Reset for blocking reads (or handle non-blocking)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Wake up at least once per interval so samples coalesced before a pause still get emitted
+            self._socket.settimeout(self.update_interval)
             
             self.connected.emit()
             
             # Read loop
-            buffer = ""
+            self._rxlen = 0
+            rxbuf = self._rxbuf
+            view = memoryview(rxbuf)
+            pending = {}
+            next_emit = 0.0
             while self._running:
                 try:
-                    data = self._socket.recv(4096)
-                    if not data:
+                    n = self._socket.recv_into(view[self._rxlen:])
+                    if n == 0:
+                        if pending:
+                            self.data_received.emit(pending)
                         break
                     
-                    buffer += data.decode('utf-8', errors='ignore')
-                    while "\n" in buffer:
-                        line, buffer = buffer.split("\n", 1)
-                        if not line.strip(): continue
-                        
-                        try:
-                            # Try parsing as JSON data
-                            data_dict = json.loads(line)
-                            self.data_received.emit(data_dict)
-                        except json.JSONDecodeError:
-                            pass # or log it
+                    end = self._rxlen + n
+                    start = 0
+                    while (nl := rxbuf.find(b"\n", start, end)) != -1:
+                        if nl > start:
+                            try:
+                                # Try parsing as JSON data, keep only the latest value per key
+                                pending.update(self._decoder.decode(view[start:nl]))
+                            except msgspec.DecodeError:
+                                pass # or log it
+                        start = nl + 1
+                    
+                    # Move the incomplete tail to the front; drop it if a line overflows the buffer
+                    self._rxlen = end - start
+                    if self._rxlen == len(rxbuf):
+                        self._rxlen = 0
+                    elif start:
+                        rxbuf[:self._rxlen] = rxbuf[start:end]
+                    
+                    now = time.monotonic()
+                    if pending and now >= next_emit:
+                        self.data_received.emit(pending)
+                        pending = {}
+                        next_emit = now + self.update_interval
                             
+                except TimeoutError:
+                    # Stream paused or stopped: flush the trailing samples
+                    if pending:
+                        self.data_received.emit(pending)
+                        pending = {}
+                        next_emit = time.monotonic() + self.update_interval
                 except OSError as e:
                     if self._running: # If we didn't intentionally stop
                         self.error_occurred.emit(str(e))
@@ -132,6 +165,23 @@ class MPUController:
         for cb, name in self.checkbox_map.items():
             cb.toggled.connect(self.on_config_changed)
             
+        # View Labels Map (built once, looked up for every received packet)
+        self._label_map = {
+            "accel_x": self.view.ui.label_mpu_acc_x,
+            "accel_y": self.view.ui.label_mpu_acc_y,
+            "accel_z": self.view.ui.label_mpu_acc_z,
+            
+            # Server returns 'anglvel' for gyro
+            "gyro_x": self.view.ui.label_mpu_angval_x, 
+            "gyro_y": self.view.ui.label_mpu_angval_y,
+            "gyro_z": self.view.ui.label_mpu_angval_z,
+            
+            "magn_x": self.view.ui.label_mpu_mag_x,
+            "magn_y": self.view.ui.label_mpu_mag_y,
+            "magn_z": self.view.ui.label_mpu_mag_z,
+        }
+        self._fmt = "{:.2f}".format
+            
         # Connect Model -> Controller/View
         self.model.connected.connect(self.on_connected)
         self.model.disconnected.connect(self.on_disconnected)
@@ -189,26 +239,12 @@ class MPUController:
         # Data keys from server (based on MPUChannel names): accel_x, anglvel_x, magn_x etc.
         # Note: server sends 'anglvel' but our protocol request was 'gyro'. 
         # The sensor buffer returns sysfs names.
-        
-        # View Labels Map
-        label_map = {
-            "accel_x": self.view.ui.label_mpu_acc_x,
-            "accel_y": self.view.ui.label_mpu_acc_y,
-            "accel_z": self.view.ui.label_mpu_acc_z,
-            
-            # Server returns 'anglvel' for gyro
-            "gyro_x": self.view.ui.label_mpu_angval_x, 
-            "gyro_y": self.view.ui.label_mpu_angval_y,
-            "gyro_z": self.view.ui.label_mpu_angval_z,
-            
-            "magn_x": self.view.ui.label_mpu_mag_x,
-            "magn_y": self.view.ui.label_mpu_mag_y,
-            "magn_z": self.view.ui.label_mpu_mag_z,
-        }
-
+        label_map = self._label_map
+        fmt = self._fmt
         for key, value in data.items():
-            if key in label_map:
-                label_map[key].setText(f"{value:.2f}")
+            label = label_map.get(key)
+            if label is not None:
+                label.setText(fmt(value))
 
 
 # --- View ---
@@ -1,12 +1,13 @@
 from __future__ import annotations
 import os
-import struct
 import threading
-import queue
+import collections
 from enum import IntFlag, auto
 from dataclasses import dataclass
 from typing import Any, TypeAlias, Final
 
+import numpy as np
+
 # 1. 定義通道 Flag
 class MPUChannel(IntFlag):
     NONE = 0
@@ -25,11 +26,24 @@ class MPUChannel(IntFlag):
     MAGN_XYZ = MAGN_X | MAGN_Y | MAGN_Z
     ALL = ACCEL_XYZ | GYRO_XYZ | MAGN_XYZ
 
+# 單一位元的通道 (x != 0 且 x & (x - 1) == 0)，於載入時計算一次
+SINGLE_BIT_CHANNELS: Final[tuple[MPUChannel, ...]] = tuple(
+    c for c in MPUChannel.__members__.values() if c.value and (c.value & (c.value - 1)) == 0
+)
+# 通道對應的資料欄位名稱 (例如 gyro_x) 與 sysfs 節點名稱 (例如 anglvel_x)
+CHANNEL_KEY: Final[dict[MPUChannel, str]] = {c: (c.name or "").lower() for c in SINGLE_BIT_CHANNELS}
+_SYSFS_BASE: Final[dict[MPUChannel, str]] = {c: k.replace("gyro", "anglvel") for c, k in CHANNEL_KEY.items()}
+
+# 每次 read() 最多取回的 scan 數量
+READ_BATCH: Final[int] = 16
+
 # 型別別名 (3.11 相容)
 SensorData: TypeAlias = dict[str, float]
 # 定義 Queue 的型別，這在 strict 模式下很重要
-# Python 3.9+ 的 queue.Queue 支援泛型標註
-SensorQueue: TypeAlias = "queue.Queue[SensorData]"
+# 單一生產者 (讀取執行緒) / 單一消費者，使用有上限的 deque，滿了自動丟棄最舊資料
+SensorQueue: TypeAlias = "collections.deque[SensorData]"
+# 一個 scan 的解析配置：(dtype, 位元組數, 欄位名稱, offsets, scales)，依 scan index 排列
+ScanLayout: TypeAlias = "tuple[np.dtype, int, tuple[str, ...], np.ndarray, np.ndarray]"
 
 @dataclass
 class ChannelMeta:
@@ -44,10 +58,13 @@ class MPU9250Buffer:
     _running: bool
     _thread: threading.Thread | None
     _active_configs: list[ChannelMeta]
-    _packet_format: str
     _packet_size: int
-    # 外部訂閱用的 Queue
+    _enable_fd: int
+    # config_channels 在 Selector 執行緒整組替換，讀取執行緒每輪只取一次，不會看到新舊混雜的配置
+    _layout: ScanLayout
+    # 外部訂閱用的 Queue 與「有新資料」事件
     _data_queue: SensorQueue
+    _data_event: threading.Event
 
     def __init__(self, symlink_path: str = "/dev/mpu_9250", q_size: int = 100) -> None:
         if not os.path.exists(symlink_path):
@@ -59,33 +76,37 @@ class MPU9250Buffer:
         self._char_dev_path = real_path
         self._device_path = f"/sys/bus/iio/devices/{dev_name}"
         
-        # 初始化 Queue，設定 maxsize 避免消費者當機導致記憶體溢位
-        self._data_queue = queue.Queue(maxsize=q_size)
+        # 初始化 Queue，設定 maxlen 避免消費者當機導致記憶體溢位
+        self._data_queue = collections.deque(maxlen=q_size)
+        self._data_event = threading.Event()
         
         self._running = False
         self._thread = None
         self._active_configs = []
-        self._packet_format = ""
         self._packet_size = 0
+        self._layout = (np.dtype((">i2", (0,))), 0, (), np.zeros(0), np.ones(0))
+        # buffer/enable 在每次配置變更時都會寫入，保持 fd 開啟以 pwrite 直接寫入
+        self._enable_fd = os.open(os.path.join(self._device_path, "buffer/enable"), os.O_WRONLY)
 
     @property
     def data_queue(self) -> SensorQueue:
-        """供外部獲取 Queue 實例以進行訂閱 (get)"""
+        """供外部獲取 Queue 實例以進行訂閱 (popleft)"""
         return self._data_queue
 
+    @property
+    def data_event(self) -> threading.Event:
+        """有新資料加入 Queue 時設定，消費者等待後自行 clear"""
+        return self._data_event
+
     def _get_sysfs_base_name(self, flag: MPUChannel) -> str:
-        name = flag.name.lower() if flag.name else ""
-        return name.replace("gyro", "anglvel")
+        return _SYSFS_BASE[flag]
 
     def config_channels(self, selection: MPUChannel) -> None:
         """配置通道，統一使用 Big Endian (>) 解析"""
         self._set_buffer_enable(0)
      
         temp_metas: list[ChannelMeta] = []
-        for flag in MPUChannel:
-            if flag == MPUChannel.NONE or bin(flag.value).count('1') > 1:
-                continue
-            
+        for flag in SINGLE_BIT_CHANNELS:
             sysfs_base = self._get_sysfs_base_name(flag)
             is_enabled = bool(selection & flag)
             
@@ -97,7 +118,7 @@ class MPU9250Buffer:
                 
                 scale, offset = self._get_metadata(sysfs_base)
                 temp_metas.append(ChannelMeta(
-                    name=flag.name.lower() if flag.name else sysfs_base,
+                    name=CHANNEL_KEY[flag],
                     index=int(idx_raw),
                     scale=scale,
                     offset=offset
@@ -106,40 +127,61 @@ class MPU9250Buffer:
         temp_metas.sort(key=lambda m: m.index)
         self._active_configs = temp_metas
         
-        # 使用 '>' Big Endian 解析
-        self._packet_format = f">{'h' * len(self._active_configs)}"
-        self._packet_size = struct.calcsize(self._packet_format)
+        # 預先建立一個 scan 的 dtype (Big Endian int16)，讀取時不必每次解析格式字串
+        scan_dtype = np.dtype((">i2", (len(self._active_configs),)))
+        self._packet_size = scan_dtype.itemsize
+        # SoA 形式的校正參數；整組一次指派
+        self._layout = (
+            scan_dtype,
+            scan_dtype.itemsize,
+            tuple(m.name for m in self._active_configs),
+            np.array([m.offset for m in self._active_configs], dtype=np.float64),
+            np.array([m.scale for m in self._active_configs], dtype=np.float64),
+        )
 
         if self._running:
             self._set_buffer_enable(1)
 
 
     def _reader_loop(self) -> None:
+        # 直接以 os.read 讀取字元設備，一次系統呼叫最多取回 READ_BATCH 個 scan
+        fd = os.open(self._char_dev_path, os.O_RDONLY)
+        # 上次 read 不足一個 scan 的殘餘位元組，只屬於產生它的 layout
+        carry = b""
+        carry_layout = self._layout
         try:
-            with open(self._char_dev_path, "rb") as dev:
-                self._set_buffer_enable(1)
-                while self._running:
-                    raw_bytes = dev.read(self._packet_size)
-                    if len(raw_bytes) < self._packet_size:
-                        continue
-                    
-                    raw_ints = struct.unpack(self._packet_format, raw_bytes)
-                    
-                    data: SensorData = {}
-                    for i, meta in enumerate(self._active_configs):
-                        data[meta.name] = (float(raw_ints[i]) + meta.offset) * meta.scale
-                    
-                    # --- 發布到 Queue ---
-                    try:
-                        # 使用 block=False 配合 maxsize，如果 Queue 滿了就丟棄舊資料，確保即時性
-                        self._data_queue.put_nowait(data)
-                    except queue.Full:
-                        try:
-                            self._data_queue.get_nowait() # 移除最舊的一筆
-                            self._data_queue.put_nowait(data)
-                        except queue.Empty:
-                            pass
+            self._set_buffer_enable(1)
+            while self._running:
+                # 每輪只讀取一次配置，本輪全部使用同一組 dtype / 大小 / 校正參數
+                layout = self._layout
+                scan_dtype, packet_size, names, offsets, scales = layout
+                if layout is not carry_layout:
+                    carry = b""
+                    carry_layout = layout
+                
+                raw_bytes = os.read(fd, packet_size * READ_BATCH)
+                if not raw_bytes:
+                    continue
+                
+                # 接上次不足一個 scan 的尾端，並保留這次多出來的部分
+                if carry:
+                    raw_bytes = carry + raw_bytes
+                count, tail = divmod(len(raw_bytes), packet_size)
+                carry = raw_bytes[-tail:] if tail else b""
+                if count == 0:
+                    continue
+                
+                # 整批解析與校正，以 NumPy 取代逐筆 struct.unpack 與 Python 運算
+                raw = np.frombuffer(raw_bytes, dtype=scan_dtype, count=count)
+                scaled = (raw + offsets) * scales
+                
+                # --- 發布到 Queue ---
+                # deque 已設定 maxlen，滿了會自動丟棄最舊的資料，確保即時性
+                for row in scaled.tolist():
+                    self._data_queue.append(dict(zip(names, row)))
+                self._data_event.set()
         finally:
+            os.close(fd)
             self._set_buffer_enable(0)
 
     # --- 內部工具 ---
@@ -159,7 +201,8 @@ class MPU9250Buffer:
             f.write(str(val))
 
     def _set_buffer_enable(self, state: int) -> None:
-        self._write_sysfs("buffer/enable", state)
+        if self._enable_fd < 0: return
+        os.pwrite(self._enable_fd, b"1" if state else b"0", 0)
 
     def start(self) -> None:
         if not self._active_configs: return
@@ -171,6 +214,13 @@ class MPU9250Buffer:
         self._running = False
         if self._thread: self._thread.join(1.0)
 
+    def close(self) -> None:
+        """停止讀取並釋放常駐的 sysfs fd，之後不可再 start"""
+        self.stop()
+        if self._enable_fd >= 0:
+            os.close(self._enable_fd)
+            self._enable_fd = -1
+
 # --- 使用方式範例 ---
 if __name__ == "__main__":
     imu = MPU9250Buffer()
@@ -179,12 +229,14 @@ if __name__ == "__main__":
 
     # 外部訂閱者 (可以是另一個執行緒)
     data_q = imu.data_queue
+    data_ready = imu.data_event
     try:
         while True:
-            # 從 Queue 拿資料，這會阻塞直到有新資料
-            sensor_packet = data_q.get() 
-            print(f"收到即時數據: {sensor_packet}")
-            # 處理完畢後標記工作完成
-            data_q.task_done()
+            # 等待新資料，先 clear 再取出，避免漏掉取出期間加入的資料
+            data_ready.wait()
+            data_ready.clear()
+            while data_q:
+                sensor_packet = data_q.popleft()
+                print(f"收到即時數據: {sensor_packet}")
     except KeyboardInterrupt:
-        imu.stop()
+        imu.close()
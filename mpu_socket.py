@@ -5,15 +5,36 @@ import socket
 import selectors
 import json
 import logging
-import queue
+import struct
 import threading
+from functools import lru_cache
 from typing import Any, TypeAlias
 
-from mpu_buffer import MPU9250Buffer, MPUChannel, SensorData
+import msgspec
+
+from mpu_buffer import MPU9250Buffer, MPUChannel, SensorData, SINGLE_BIT_CHANNELS, CHANNEL_KEY
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
 ClientState: TypeAlias = dict[str, Any]
+SocketOption: TypeAlias = tuple[int, int, int]
+
+# 資料包小且頻繁，關閉 Nagle 避免與 delayed ACK 疊加造成延遲
+DEFAULT_SOCKET_OPTIONS: list[SocketOption] = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+
+# 指令參數名稱 -> 通道，含 ACCEL_XYZ 等組合名稱；sysfs 的 ANGLVEL 視同 GYRO
+_NAME_TO_FLAG: dict[str, MPUChannel] = {
+    **MPUChannel.__members__,
+    **{name.replace("GYRO", "ANGLVEL"): flag
+       for name, flag in MPUChannel.__members__.items() if name.startswith("GYRO")},
+}
+# 每次廣播最多合併的資料筆數，一次 sendall 送出多行 JSON
+BROADCAST_BATCH = 32
+
+@lru_cache(maxsize=None)
+def _frame_struct(n: int) -> struct.Struct:
+    """二進位資料框：1 byte 通道數 n + 2 byte 通道遮罩 + n 個 float32，皆為 little-endian"""
+    return struct.Struct(f"<BH{n}f")
 
 class MPUSocketServerNonBlocking:
     _mpu: MPU9250Buffer
@@ -21,13 +42,29 @@ class MPUSocketServerNonBlocking:
     _clients: dict[socket.socket, ClientState]
     _is_running: bool
     _clients_lock: threading.RLock
+    _encoder: msgspec.json.Encoder
+    _mask_to_keys: dict[int, tuple[str, ...]]
+    _socket_options: list[SocketOption]
+    # 廣播執行緒發送失敗、待 Selector 執行緒移除的連線
+    _pending_remove: set[socket.socket]
+    # 串流中 Client 的 (conn, mask, binary) 快照，僅在狀態變更時重建，廣播執行緒免鎖讀取
+    _clients_snapshot: tuple[tuple[socket.socket, int, bool], ...]
 
-    def __init__(self, mpu_buffer: MPU9250Buffer, host: str = '0.0.0.0', port: int = 8888) -> None:
+    def __init__(self, mpu_buffer: MPU9250Buffer, host: str = '0.0.0.0', port: int = 8888,
+                 socket_options: list[SocketOption] | None = None) -> None:
+        """socket_options 會套用到每個新連線 (level, optname, value)，預設為 DEFAULT_SOCKET_OPTIONS"""
         self._mpu = mpu_buffer
+        self._socket_options = DEFAULT_SOCKET_OPTIONS if socket_options is None else socket_options
         self._selector = selectors.DefaultSelector()
         self._clients = {}
         self._clients_lock = threading.RLock()
+        self._pending_remove = set()
+        self._clients_snapshot = ()
         self._is_running = False
+        # 重複使用同一個 Encoder，避免每筆資料重新建立 (輸出仍為 JSON，維持協定相容)
+        self._encoder = msgspec.json.Encoder()
+        # 各遮罩對應的資料欄位，於 config 時計算一次，廣播時直接查表
+        self._mask_to_keys = {int(MPUChannel.NONE): ()}
         
         self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._server_sock.setblocking(False)
@@ -36,6 +73,12 @@ class MPUSocketServerNonBlocking:
         self._server_sock.listen(3)
         
         self._selector.register(self._server_sock, selectors.EVENT_READ, self._accept)
+        
+        # 其他執行緒透過 socketpair 喚醒 Selector，Selector 本身只在主迴圈執行緒操作
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, self._on_wakeup)
 
     def _accept(self, sock: socket.socket, mask: int) -> None:
         try:
@@ -47,11 +90,14 @@ class MPUSocketServerNonBlocking:
                 
             logging.info(f"新連線來自：{addr}")
             conn.setblocking(False)
+            for level, optname, value in self._socket_options:
+                conn.setsockopt(level, optname, value)
             
             with self._clients_lock:
                 self._clients[conn] = {
                     "mask": MPUChannel.NONE,
                     "streaming": False,
+                    "binary": False,
                     "buffer": ""
                 }
             
@@ -96,10 +142,19 @@ class MPUSocketServerNonBlocking:
         with self._clients_lock:
             if action == "config_channels":
                 new_mask = MPUChannel.NONE
-                for p in params:
-                    try: new_mask |= MPUChannel[p.upper()]
-                    except: pass
+                mask = cmd.get("mask")
+                if isinstance(mask, int):
+                    # 整數遮罩格式：位元定義與 MPUChannel 相同，忽略未定義的位元
+                    new_mask = MPUChannel(mask & MPUChannel.ALL)
+                else:
+                    for p in params:
+                        flag = _NAME_TO_FLAG.get(p.upper()) if isinstance(p, str) else None
+                        if flag is not None:
+                            new_mask |= flag
                 self._clients[conn]["mask"] = new_mask
+                if int(new_mask) not in self._mask_to_keys:
+                    self._mask_to_keys[int(new_mask)] = tuple(
+                        CHANNEL_KEY[c] for c in SINGLE_BIT_CHANNELS if new_mask & c)
                 # 配置變更後立即更新硬體
                 self._update_hardware()
                 
@@ -111,6 +166,11 @@ class MPUSocketServerNonBlocking:
                 self._clients[conn]["streaming"] = False
                 self._update_hardware()
                 
+            elif action == "set_format":
+                # "binary" 改送固定格式的二進位資料框，其他值回到 JSON
+                self._clients[conn]["binary"] = bool(params) and str(params[0]).lower() == "binary"
+                self._rebuild_snapshot()
+                
             elif action == "disconnect":
                 self._remove_client(conn)
 
@@ -126,6 +186,9 @@ class MPUSocketServerNonBlocking:
                 if info["streaming"]:
                     any_streaming = True
             
+            # Client 增減、遮罩或串流狀態變更都會經過這裡，順便重建廣播用快照
+            self._rebuild_snapshot()
+            
             # 1. 如果有需求，更新硬體配置 (config_channels 會重新計算 packet_size)
             if union_mask != MPUChannel.NONE:
                 self._mpu.config_channels(union_mask)
@@ -141,49 +204,105 @@ class MPUSocketServerNonBlocking:
                     logging.info("目前無活動串流，停止 MPU 讀取執行緒以節省資源")
                     self._mpu.stop()
 
+    def _rebuild_snapshot(self) -> None:
+        with self._clients_lock:
+            self._clients_snapshot = tuple(
+                (conn, int(info["mask"]), info["binary"])
+                for conn, info in self._clients.items() if info["streaming"])
+
     def _flush_queue(self) -> None:
-        q = self._mpu.data_queue
-        while not q.empty():
-            try:
-                q.get_nowait()
-                q.task_done()
-            except: break
+        self._mpu.data_queue.clear()
 
     def _broadcast_loop(self) -> None:
         q = self._mpu.data_queue
+        data_ready = self._mpu.data_event
         while self._is_running:
-            try:
-                data = q.get(timeout=0.5)
-            except queue.Empty:
+            if not data_ready.wait(0.5):
                 continue
+            # 先 clear 再取資料，取出期間新加入的資料會重新 set，不會遺漏喚醒
+            data_ready.clear()
+            # 取出目前已累積的資料，攤平編碼與系統呼叫的固定成本
+            batch: list[SensorData] = []
+            while len(batch) < BROADCAST_BATCH:
+                try:
+                    batch.append(q.popleft())
+                except IndexError:
+                    break
+            if not batch:
+                continue
+            if q:
+                data_ready.set()
 
-            with self._clients_lock:
-                for conn, state in list(self._clients.items()):
-                    if state["streaming"]:
-                        try:
-                            # 根據 Client 的遮罩過濾資料包
-                            m = state["mask"]
-                            filtered = {k: v for k, v in data.items() 
-                                       if k in [f.name.lower() for f in MPUChannel if (m & f) and bin(f.value).count('1')==1]}
-                            
-                            if filtered:
-                                payload = json.dumps(filtered).encode('utf-8') + b'\n'
-                                conn.sendall(payload)
-                        except (OSError, ConnectionResetError):
-                            # 發送失敗也視同斷開，執行清理
-                            self._remove_client(conn)
-            q.task_done()
+            # 快照為不可變 tuple，不需持鎖；sendall 在鎖外進行，避免阻塞 accept 與指令處理
+            snapshot = self._clients_snapshot
+
+            # 同一遮罩與格式的 Client 共用同一份編碼結果，每批資料每種組合只編碼一次
+            cache: dict[tuple[int, bool], bytes] = {}
+            for conn, m, binary in snapshot:
+                try:
+                    # 根據 Client 的遮罩過濾資料包
+                    payload = cache.get((m, binary))
+                    if payload is None:
+                        keys = self._mask_to_keys[m]
+                        if binary:
+                            payload = self._encode_frames(m, keys, batch)
+                        else:
+                            filtered = [{k: data[k] for k in keys if k in data} for data in batch]
+                            # encode_lines 產生以換行分隔的 JSON，與逐筆傳送的格式相同
+                            payload = self._encoder.encode_lines([d for d in filtered if d])
+                        cache[(m, binary)] = payload
+                    
+                    if payload:
+                        conn.sendall(payload)
+                except (OSError, ConnectionResetError):
+                    # 發送失敗也視同斷開，交由 Selector 執行緒清理
+                    with self._clients_lock:
+                        self._pending_remove.add(conn)
+                    self._wakeup()
+
+    @staticmethod
+    def _encode_frames(mask: int, keys: tuple[str, ...], batch: list[SensorData]) -> bytes:
+        """依遮罩的通道順序打包二進位資料框，缺少的通道填 NaN；標頭帶遮罩，Client 不必猜測配置"""
+        if not keys:
+            return b""
+        pack = _frame_struct(len(keys)).pack
+        n = len(keys)
+        nan = float("nan")
+        return b"".join(pack(n, mask, *[data.get(k, nan) for k in keys]) for data in batch)
+
+    def _wakeup(self) -> None:
+        try:
+            self._wake_w.send(b"x")
+        except OSError:
+            pass # 緩衝區已滿代表已有待處理的喚醒
+
+    def _on_wakeup(self, sock: socket.socket, mask: int) -> None:
+        try:
+            while sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        self._drain_pending_remove()
+
+    def _drain_pending_remove(self) -> None:
+        """於 Selector 執行緒移除廣播時發送失敗的 Client"""
+        with self._clients_lock:
+            pending, self._pending_remove = self._pending_remove, set()
+        for conn in pending:
+            self._remove_client(conn)
 
     def _remove_client(self, conn: socket.socket) -> None:
         with self._clients_lock:
-            if conn in self._clients:
-                try:
-                    # 先從 Selector 取消註冊，防止重複觸發回呼
-                    self._selector.unregister(conn)
-                    conn.close()
-                except: pass
-                del self._clients[conn]
-                logging.info("已移除 Client 並釋放資源")
+            # 廣播執行緒依快照發送，可能對已移除的連線再次排入移除；此時不必重設硬體
+            if conn not in self._clients:
+                return
+            try:
+                # 先從 Selector 取消註冊，防止重複觸發回呼
+                self._selector.unregister(conn)
+                conn.close()
+            except: pass
+            del self._clients[conn]
+            logging.info("已移除 Client 並釋放資源")
         
         # 移除 Client 後務必重新檢查硬體狀態 (若無 Client 則停止執行緒)
         self._update_hardware()
@@ -204,9 +323,11 @@ class MPUSocketServerNonBlocking:
 
     def stop(self) -> None:
         self._is_running = False
-        self._mpu.stop()
+        self._mpu.close()
         self._selector.close()
         self._server_sock.close()
+        self._wake_r.close()
+        self._wake_w.close()
         logging.info("伺服器停止")
 
 if __name__ == "__main__":
@@ -215,7 +336,7 @@ if __name__ == "__main__":
 # 定義訊號處理器
     def handle_exit(signum, frame):
         logging.info(f"接收到訊號 {signum}，正在關閉 Daemon...")
-        server.stop() # 這會呼叫 mpu.stop() 關閉硬體執行緒與 Buffer
+        server.stop() # 這會呼叫 mpu.close() 關閉硬體執行緒與 Buffer
         sys.exit(0)
 
     # 註冊訊號
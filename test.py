@@ -1,34 +1,181 @@
 from __future__ import annotations
+import os
+import sys
 import socket
+import selectors
+import struct
 import threading
-import json
+import collections
 import time
+from functools import lru_cache
 from typing import Any
 
+# 優先使用 C 實作的 JSON 函式庫：orjson > ujson > 標準庫 json
+try:
+    import orjson
+    loads = orjson.loads
+    dumps = orjson.dumps
+except ImportError:
+    try:
+        import ujson as _json  # type: ignore[import-not-found]
+    except ImportError:
+        import json as _json
+
+    def loads(data: Any) -> Any:
+        # 標準庫 json 不接受 memoryview，先轉成 bytes
+        return _json.loads(bytes(data))
+
+    def dumps(obj: Any) -> bytes:
+        return _json.dumps(obj).encode('utf-8')
+
+@lru_cache(maxsize=128)
+def _encode(action: str, params: tuple[str, ...]) -> bytes:
+    """指令編碼結果快取，重複的指令不必再序列化"""
+    # 必須加上 \n 作為訊息結尾
+    return dumps({"action": action, "params": list(params)}) + b'\n'
+
+# 測試流程固定的指令序列，載入時即預先編碼
+SCRIPT: tuple[bytes, ...] = tuple(_encode(action, params) for action, params in (
+    ("config_channels", ("ACCEL_X", "ACCEL_Y", "GYRO_Z")),
+    ("start_send", ()),
+    ("config_channels", ("ACCEL_XYZ",)),
+    ("stop_send", ()),
+    ("disconnect", ()),
+))
+
+# 測試流程各階段要收到的資料筆數
+STREAM_PACKETS = 500
+SWITCH_PACKETS = 300
+
+# 通道名稱對應的位元，與伺服器端 MPUChannel 的定義相同
+CHANNEL_BITS: dict[str, int] = {
+    "ACCEL_X": 1 << 0, "ACCEL_Y": 1 << 1, "ACCEL_Z": 1 << 2,
+    "GYRO_X": 1 << 3, "GYRO_Y": 1 << 4, "GYRO_Z": 1 << 5,
+    "MAGN_X": 1 << 6, "MAGN_Y": 1 << 7, "MAGN_Z": 1 << 8,
+}
+CHANNEL_BITS["ACCEL_XYZ"] = CHANNEL_BITS["ACCEL_X"] | CHANNEL_BITS["ACCEL_Y"] | CHANNEL_BITS["ACCEL_Z"]
+CHANNEL_BITS["GYRO_XYZ"] = CHANNEL_BITS["GYRO_X"] | CHANNEL_BITS["GYRO_Y"] | CHANNEL_BITS["GYRO_Z"]
+CHANNEL_BITS["MAGN_XYZ"] = CHANNEL_BITS["MAGN_X"] | CHANNEL_BITS["MAGN_Y"] | CHANNEL_BITS["MAGN_Z"]
+CHANNEL_BITS["ALL"] = CHANNEL_BITS["ACCEL_XYZ"] | CHANNEL_BITS["GYRO_XYZ"] | CHANNEL_BITS["MAGN_XYZ"]
+
+@lru_cache(maxsize=None)
+def _mask_keys(mask: int) -> tuple[str, ...]:
+    """通道遮罩對應的資料欄位名稱 (依通道位元順序)"""
+    # 只取單一位元的通道，名稱轉小寫即為伺服器送出的欄位名稱
+    return tuple(name.lower() for name, bit in CHANNEL_BITS.items() if mask & bit and not bit & (bit - 1))
+
+@lru_cache(maxsize=128)
+def _encode_mask(mask: int) -> bytes:
+    """以整數遮罩配置通道，比字串清單更短且編碼、解析都更快"""
+    return dumps({"action": "config_channels", "mask": mask}) + b'\n'
+
+@lru_cache(maxsize=None)
+def _frame_struct(n: int) -> struct.Struct:
+    """二進位資料框的通道遮罩 (uint16) 與 n 個 float32，皆為 little-endian (不含開頭的通道數)"""
+    return struct.Struct(f"<H{n}f")
+
+# JSON 資料以 '{' 開頭；二進位資料框的第一個 byte 是通道數 (1~9)，不會與其混淆
+_JSON_START = ord("{")
+# 二進位資料框：1 byte 通道數 + 2 byte 遮罩，之後每個通道 4 byte
+_FRAME_HEADER = 3
+
+# 接收執行緒與解析執行緒之間最多暫存的行數，滿了丟棄最舊的
+RX_QUEUE_SIZE = 10_000
+
+# Linux 才有 TCP_QUICKACK，其他平台為 None
+_TCP_QUICKACK: int | None = getattr(socket, "TCP_QUICKACK", None)
+# Python 的 socket 模組未匯出 SO_BUSY_POLL，Linux 上的值為 46
+_SO_BUSY_POLL: int | None = getattr(socket, "SO_BUSY_POLL", 46 if sys.platform.startswith("linux") else None)
+# Linux 才有 SO_INCOMING_CPU，其他平台為 None
+_SO_INCOMING_CPU: int | None = getattr(socket, "SO_INCOMING_CPU", None)
+
 class MPUTestClient:
     _host: str
     _port: int
     _sock: socket.socket | None
     _is_running: bool
     _receive_thread: threading.Thread | None
+    # 接收執行緒只負責切行，解析與顯示交給解析執行緒
+    _parse_thread: threading.Thread | None
+    _rx_q: collections.deque[bytes]
+    _rx_event: threading.Event
+    # 收到第一筆資料、以及每批資料解析完成時設定，取代腳本中固定秒數的等待
+    _first_packet: threading.Event
+    _rx_progress: threading.Event
+    _sel: selectors.BaseSelector
+    # 重新連線時沿用的接收緩衝區與其中尚未處理的位元組數
+    _rxbuf: bytearray
+    _rxlen: int
+    # 各通道遮罩重複使用的資料 dict，二進位資料框直接覆寫其中的數值
+    _arenas: dict[int, dict[str, float]]
+    _latest: dict[str, Any] | None
+    # 要求過二進位格式後，串流中可能混有 JSON 行與二進位資料框
+    _mixed_framing: bool
+    # SO_BUSY_POLL 的忙碌輪詢時間 (微秒)，0 表示不啟用
+    _busy_poll_us: int
+    # 接收執行緒綁定的 CPU，None 表示不綁定
+    _pin_cpu: int | None
+    # 顯示控制：verbose 時每 print_every 筆輸出一次
+    _verbose: bool
+    _print_every: int
+    _rx_count: int
 
-    def __init__(self, host: str = "192.168.1.114", port: int = 8888) -> None:
+    def __init__(self, host: str = "192.168.1.114", port: int = 8888,
+                 verbose: bool = False, print_every: int = 100, busy_poll_us: int = 50,
+                 pin_cpu: int | None = None) -> None:
         self._host = host
         self._port = port
         self._sock = None
         self._is_running = False
         self._receive_thread = None
+        self._parse_thread = None
+        self._rx_q = collections.deque(maxlen=RX_QUEUE_SIZE)
+        self._rx_event = threading.Event()
+        self._first_packet = threading.Event()
+        self._rx_progress = threading.Event()
+        # selector 與接收緩衝區只配置一次，每次連線只註冊 / 取消註冊 socket
+        self._sel = selectors.DefaultSelector()
+        self._rxbuf = bytearray(1 << 20)
+        self._rxlen = 0
+        self._mixed_framing = False
+        self._arenas = {}
+        self._latest = None
+        self._busy_poll_us = busy_poll_us
+        self._pin_cpu = pin_cpu
+        self._verbose = verbose
+        self._print_every = max(1, print_every)
+        self._rx_count = 0
 
     def connect(self) -> bool:
         """建立 Socket 連線"""
+        # 伺服器端斷線後舊的解析執行緒可能仍在等待，先確實結束，避免兩個解析執行緒同時消費佇列
+        self._stop_threads()
         try:
             self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # 指令封包很小，關閉 Nagle 讓指令立即送出
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # 收包時核心先忙碌輪詢網卡佇列，以少量 CPU 換取較低的喚醒延遲；
+            # 調高此值需要 CAP_NET_ADMIN，權限不足時維持預設
+            if _SO_BUSY_POLL is not None and self._busy_poll_us > 0:
+                try:
+                    self._sock.setsockopt(socket.SOL_SOCKET, _SO_BUSY_POLL, self._busy_poll_us)
+                except OSError:
+                    pass
             self._sock.connect((self._host, self._port))
+            self._sel.register(self._sock, selectors.EVENT_READ)
+            # 清除上一次連線殘留的資料
+            self._rxlen = 0
+            self._mixed_framing = False
+            self._rx_q.clear()
+            self._rx_event.clear()
+            self._first_packet.clear()
             self._is_running = True
             
             # 啟動接收執行緒
             self._receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
             self._receive_thread.start()
+            self._parse_thread = threading.Thread(target=self._parse_loop, daemon=True)
+            self._parse_thread.start()
             print(f"[*] 已成功連線至 {self._host}:{self._port}")
             return True
         except ConnectionRefusedError:
@@ -37,83 +184,272 @@ class MPUTestClient:
 
     def send_cmd(self, action: str, params: list[str] | None = None) -> None:
         """發送 JSON 指令"""
+        self.send_payload(_encode(action, tuple(params or ())))
+
+    def send_payload(self, payload: bytes) -> None:
+        """發送已編碼好的指令 (需含結尾換行)"""
         if not self._sock:
             return
         
-        cmd = {
-            "action": action,
-            "params": params or []
-        }
         try:
-            # 必須加上 \n 作為訊息結尾
-            payload = json.dumps(cmd).encode('utf-8') + b'\n'
             self._sock.sendall(payload)
-            print(f"[Send] {cmd}")
+            print(f"[Send] {payload.decode('utf-8').rstrip()}")
+        except Exception as e:
+            print(f"[!] 發送指令失敗: {e}")
+
+    def send_channels(self, names: list[str]) -> None:
+        """以整數遮罩發送 config_channels，名稱需為 CHANNEL_BITS 的鍵"""
+        mask = 0
+        for name in names:
+            mask |= CHANNEL_BITS[name.upper()]
+        self.send_mask(mask)
+
+    def send_mask(self, mask: int) -> None:
+        """直接發送已組好的通道遮罩"""
+        self.send_payload(_encode_mask(mask))
+
+    def send_format(self, fmt: str) -> None:
+        """切換資料格式："binary" 為固定格式的二進位資料框，"json" 為預設的 JSON 行"""
+        if fmt == "binary":
+            self._mixed_framing = True
+        self.send_cmd("set_format", [fmt])
+
+    def send_cmds(self, cmds: list[tuple[str, list[str] | None]]) -> None:
+        """一次發送多筆 JSON 指令，以 sendmsg 合併成單一系統呼叫"""
+        if not self._sock or not cmds:
+            return
+        
+        payloads = [_encode(action, tuple(params or ())) for action, params in cmds]
+        try:
+            if hasattr(self._sock, "sendmsg"):
+                sent = self._sock.sendmsg(payloads)
+                # 部分送出時以 sendall 補送剩餘資料
+                if sent < sum(len(p) for p in payloads):
+                    self._sock.sendall(b"".join(payloads)[sent:])
+            else:
+                # Windows 沒有 sendmsg
+                self._sock.sendall(b"".join(payloads))
+            for payload in payloads:
+                print(f"[Send] {payload.decode('utf-8').rstrip()}")
         except Exception as e:
             print(f"[!] 發送指令失敗: {e}")
 
     def _receive_loop(self) -> None:
-        """持續接收伺服器回傳的 JSON 資料"""
-        buffer = ""
-        while self._is_running and self._sock:
+        """持續接收伺服器回傳的資料，切成完整的行後交給解析執行緒"""
+        # recv_into 直接寫入預先配置的緩衝區，以 memoryview 切片解析，不產生中間 bytes
+        rxbuf = self._rxbuf
+        view = memoryview(rxbuf)
+        sock, sel = self._sock, self._sel
+        if sock is None:
+            return
+        if self._pin_cpu is not None:
+            self._pin_receive_cpu(sock, self._pin_cpu)
+        # 由 selector 通知可讀才 recv，逾時即回頭檢查旗標；close() 只需清除旗標即可結束迴圈
+        while self._is_running:
             try:
-                data = self._sock.recv(4096).decode('utf-8')
-                if not data:
+                if not sel.select(timeout=0.2):
+                    continue
+                n = sock.recv_into(view[self._rxlen:])
+                if not n:
                     print("[*] 伺服器已中斷連線")
                     break
                 
-                buffer += data
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    try:
-                        sensor_packet = json.loads(line)
-                        # 格式化輸出資料
-                        print(f"\r[Recv] {sensor_packet}", end="")
-                    except json.JSONDecodeError:
-                        pass
+                # quick ACK 模式會被核心自動關閉，每批接收後重新開啟以避免 delayed ACK
+                if _TCP_QUICKACK is not None:
+                    sock.setsockopt(socket.IPPROTO_TCP, _TCP_QUICKACK, 1)
+                
+                end = self._rxlen + n
+                if self._mixed_framing:
+                    start = self._split_frames(rxbuf, view, end)
+                else:
+                    # 以最後一個換行為界，一次 C 層級的 split 切出所有完整的行，
+                    # 取代逐行 find 的 Python 迴圈；filter(None) 略過空行
+                    start = rxbuf.rfind(b"\n", self._rxlen, end) + 1
+                    if start:
+                        self._rx_q.extend(filter(None, bytes(view[:start - 1]).split(b"\n")))
+                if start:
+                    self._rx_event.set()
+                
+                # 未完整的尾端搬回開頭；單行超過緩衝區大小則直接丟棄
+                self._rxlen = end - start
+                if self._rxlen == len(rxbuf):
+                    self._rxlen = 0
+                elif start:
+                    rxbuf[:self._rxlen] = rxbuf[start:end]
             except Exception as e:
                 if self._is_running:
                     print(f"\n[!] 接收錯誤: {e}")
                 break
         self._is_running = False
+        # Socket 由接收執行緒自行關閉並取消註冊，不必靠關閉 socket 觸發例外來結束
+        self._release()
+
+    @staticmethod
+    def _pin_receive_cpu(sock: socket.socket, cpu: int) -> None:
+        """把接收執行緒與核心的收包處理固定在同一顆 CPU，減少跨核心的快取失效"""
+        # 只有 Linux 支援，其他平台略過
+        try:
+            os.sched_setaffinity(0, {cpu})  # 0 代表目前的執行緒
+            if _SO_INCOMING_CPU is not None:
+                sock.setsockopt(socket.SOL_SOCKET, _SO_INCOMING_CPU, cpu)
+        except (AttributeError, OSError):
+            pass
+
+    def _split_frames(self, rxbuf: bytearray, view: memoryview, end: int) -> int:
+        """依第一個 byte 切出 JSON 行或二進位資料框，回傳已處理的位元組數"""
+        q = self._rx_q
+        start = 0
+        while start < end:
+            head = rxbuf[start]
+            if head == _JSON_START:
+                nl = rxbuf.find(b"\n", start, end)
+                if nl == -1:
+                    break
+                q.append(bytes(view[start:nl]))
+                start = nl + 1
+            elif head == 0x0A:
+                start += 1
+            else:
+                size = _FRAME_HEADER + 4 * head
+                if start + size > end:
+                    break
+                q.append(bytes(view[start:start + size]))
+                start += size
+        return start
+
+    def _parse_loop(self) -> None:
+        """解析 JSON 並抽樣顯示，與接收執行緒以有上限的 deque 串接"""
+        q = self._rx_q
+        while self._is_running or q:
+            if not self._rx_event.wait(0.2):
+                continue
+            # 先 clear 再取資料，取出期間新加入的資料會重新 set
+            self._rx_event.clear()
+            count = self._rx_count
+            while q:
+                line = q.popleft()
+                # 只有要求過二進位格式時才可能出現資料框，其餘一律當 JSON 解析
+                if line[0] == _JSON_START or not self._mixed_framing:
+                    try:
+                        self._latest = loads(line)
+                    except ValueError:
+                        continue
+                    self._rx_count += 1
+                    # 抽樣輸出原始 JSON，避免每筆資料都格式化並寫入終端機
+                    if self._verbose and self._rx_count % self._print_every == 0:
+                        self._print_packet(line)
+                else:
+                    n = line[0]
+                    if len(line) != _FRAME_HEADER + 4 * n:
+                        continue # 長度與標頭不符，略過
+                    mask, *values = _frame_struct(n).unpack_from(line, 1)
+                    # 依資料框自帶的遮罩取得欄位名稱，配置切換前後的資料框都能正確對應
+                    keys = _mask_keys(mask)
+                    if len(keys) != n:
+                        continue # 遮罩與通道數不符，略過
+                    self._rx_count += 1
+                    pkt = self._arenas.get(mask)
+                    if pkt is None:
+                        pkt = self._arenas[mask] = dict.fromkeys(keys, 0.0)
+                    # 覆寫同一個 dict，每筆資料不再配置新的 dict
+                    pkt.update(zip(keys, values))
+                    self._latest = pkt
+                    if self._verbose and self._rx_count % self._print_every == 0:
+                        self._print_packet(dumps(pkt))
+            if self._rx_count != count:
+                self._first_packet.set()
+                self._rx_progress.set()
+
+    @property
+    def latest(self) -> dict[str, Any] | None:
+        """最後一筆解析的資料；二進位格式下每次都是同一個 dict，需保留時請自行複製"""
+        return self._latest
+
+    @property
+    def rx_count(self) -> int:
+        """目前累計解析成功的資料筆數"""
+        return self._rx_count
+
+    def wait_first_packet(self, timeout: float) -> bool:
+        """等待本次連線的第一筆資料，逾時回傳 False"""
+        return self._first_packet.wait(timeout)
+
+    def wait_packets(self, count: int, timeout: float) -> bool:
+        """等待累計收到的資料筆數達到 count，逾時回傳 False"""
+        deadline = time.monotonic() + timeout
+        while self._rx_count < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # 醒來後先 clear 再檢查筆數，不會漏掉期間的更新
+            self._rx_progress.wait(remaining)
+            self._rx_progress.clear()
+        return True
+
+    def _print_packet(self, raw: bytes) -> None:
+        out = getattr(sys.stdout, "buffer", None)
+        if out is None:
+            print(f"\r[Recv] {raw.decode('utf-8')}", end="")
+            return
+        sys.stdout.flush()
+        out.write(b"\r[Recv] ")
+        out.write(raw)
+        out.flush()
+
+    def _release(self) -> None:
+        sock = self._sock
+        if sock:
+            self._sock = None
+            # selector 保留給下一次連線使用，只取消註冊
+            try:
+                self._sel.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            sock.close()
+
+    def _stop_threads(self) -> None:
+        """結束上一次連線的接收與解析執行緒並釋放資源"""
+        self._is_running = False
+        # 接收與解析迴圈最多在一個逾時 (0.2 秒) 內結束，接收執行緒會釋放資源
+        for thread in (self._receive_thread, self._parse_thread):
+            if thread and thread.is_alive() and thread is not threading.current_thread():
+                thread.join(1.0)
+        self._release()
 
     def close(self) -> None:
         """關閉連線"""
-        self._is_running = False
-        if self._sock:
-            self._sock.close()
-            self._sock = None
+        self._stop_threads()
         print("\n[*] 用戶端已關閉")
 
 # --- 測試流程腳本 ---
 if __name__ == "__main__":
-    client = MPUTestClient()
+    client = MPUTestClient(verbose=True, print_every=10)
     
     if client.connect():
         try:
             # 1. 配置通道 (例如：加速度 X, Y 與 陀螺儀 Z)
-            client.send_cmd("config_channels", ["ACCEL_X", "ACCEL_Y", "GYRO_Z"])
-            time.sleep(0.5)
+            client.send_payload(SCRIPT[0])
             
-            # 2. 開始接收串流
+            # 2. 開始接收串流 (TCP 保證指令依序處理，不必等待配置完成)
             print("\n[*] 請求啟動數據傳送...")
-            client.send_cmd("start_send")
+            client.send_payload(SCRIPT[1])
             
-            # 模擬接收 5 秒鐘
-            time.sleep(5)
+            # 等到第一筆資料後再收 STREAM_PACKETS 筆，逾時則照樣往下執行
+            if not client.wait_first_packet(1.0):
+                print("\n[!] 等待第一筆資料逾時")
+            client.wait_packets(client.rx_count + STREAM_PACKETS, 5.0)
             
             # 3. 測試動態更改通道 (例如改為只拿加速度)
             print("\n\n[*] 測試動態切換通道為 ACCEL_XYZ...")
-            client.send_cmd("config_channels", ["ACCEL_XYZ"])
-            time.sleep(3)
+            client.send_payload(SCRIPT[2])
+            client.wait_packets(client.rx_count + SWITCH_PACKETS, 3.0)
             
             # 4. 停止接收
             print("\n\n[*] 停止傳送數據...")
-            client.send_cmd("stop_send")
-            time.sleep(1)
+            client.send_payload(SCRIPT[3])
             
             # 5. 中斷連線
-            client.send_cmd("disconnect")
+            client.send_payload(SCRIPT[4])
             
         except KeyboardInterrupt:
             pass
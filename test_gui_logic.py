@@ -1,6 +1,7 @@
 import sys
-import time
 import unittest
+from collections import deque
+from PySide6.QtCore import QEventLoop, QTimer
 from PySide6.QtWidgets import QApplication
 from mpu9250_ui_app import MPUModel
 
@@ -10,27 +11,43 @@ app = QApplication(sys.argv)
 class TestMPUModel(unittest.TestCase):
     def setUp(self):
         self.model = MPUModel()
-        self.received_data = []
+        # Keep only the latest packets; rx_count tracks how many arrived
+        self.received_data = deque(maxlen=16)
+        self.rx_count = 0
         self.connected = False
+        # Event loop quit by the slots below instead of polling with sleep
+        self.wait_loop = QEventLoop()
+        self.wait_timer = QTimer()
+        self.wait_timer.setSingleShot(True)
+        self.wait_timer.timeout.connect(self.wait_loop.quit)
+        self.wait_count = 0
         
         self.model.connected.connect(self.on_connected)
         self.model.data_received.connect(self.on_data)
         
     def on_connected(self):
         self.connected = True
+        self.wait_loop.quit()
         
     def on_data(self, data):
+        self.rx_count += 1
         self.received_data.append(data)
+        if self.rx_count >= self.wait_count:
+            self.wait_loop.quit()
+
+    def wait(self, timeout_ms):
+        # Returns as soon as a slot quits the loop, or after timeout_ms
+        self.wait_timer.start(timeout_ms)
+        self.wait_loop.exec()
+        self.wait_timer.stop()
 
     def test_connection_and_streaming(self):
         print("Connecting to mock server...")
         self.model.connect_server("127.0.0.1", 8888)
         
         # Wait for connection
-        start = time.time()
-        while not self.connected and time.time() - start < 2:
-            app.processEvents()
-            time.sleep(0.1)
+        if not self.connected:
+            self.wait(2000)
             
         self.assertTrue(self.connected, "Failed to connect to mock server")
         print("Connected.")
@@ -43,13 +60,12 @@ class TestMPUModel(unittest.TestCase):
         self.model.send_command("config_channels", ["accel_x", "gyro_z"])
         
         # Wait for data
-        start = time.time()
-        while len(self.received_data) < 5 and time.time() - start < 5:
-            app.processEvents()
-            time.sleep(0.1)
+        self.wait_count = 5
+        if self.rx_count < self.wait_count:
+            self.wait(5000)
             
-        self.assertGreater(len(self.received_data), 0, "No data received")
-        print(f"Received {len(self.received_data)} packets")
+        self.assertGreater(self.rx_count, 0, "No data received")
+        print(f"Received {self.rx_count} packets")
         print(f"Sample packet: {self.received_data[0]}")
         
         # Verify packet structure (roughly)
@@ -0,0 +1,126 @@
+import collections
+import importlib.util
+import os
+import socket
+import threading
+import unittest
+
+from mpu_buffer import MPUChannel
+from mpu_socket import MPUSocketServerNonBlocking
+
+# test.py shares its name with the stdlib "test" package, so load it by path
+_spec = importlib.util.spec_from_file_location(
+    "mpu_test_client", os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py"))
+client_mod = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(client_mod)
+
+
+class FakeBuffer:
+    """Stands in for MPU9250Buffer without touching the IIO device"""
+    def __init__(self):
+        self.data_queue = collections.deque(maxlen=100)
+        self.data_event = threading.Event()
+        self._running = False
+        self.mask = MPUChannel.NONE
+        self.configs = 0
+
+    def config_channels(self, selection):
+        self.mask = selection
+        self.configs += 1
+
+    def start(self):
+        self._running = True
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        self.stop()
+
+
+class TestProtocol(unittest.TestCase):
+    def setUp(self):
+        self.mpu = FakeBuffer()
+        self.server = MPUSocketServerNonBlocking(self.mpu, host="127.0.0.1", port=0)
+        self.conn, self.peer = socket.socketpair()
+        self.server._clients[self.conn] = {
+            "mask": MPUChannel.NONE, "streaming": False, "binary": False, "buffer": ""}
+
+    def tearDown(self):
+        self.server.stop()
+        self.conn.close()
+        self.peer.close()
+
+    def test_config_channels_mask(self):
+        mask = int(MPUChannel.ACCEL_X | MPUChannel.GYRO_Z)
+        # Bits outside MPUChannel.ALL are ignored
+        self.server._process_command(self.conn, {"action": "config_channels", "mask": mask | (1 << 12)})
+
+        self.assertEqual(self.server._clients[self.conn]["mask"], MPUChannel.ACCEL_X | MPUChannel.GYRO_Z)
+        self.assertEqual(self.mpu.mask, MPUChannel.ACCEL_X | MPUChannel.GYRO_Z)
+        self.assertEqual(self.server._mask_to_keys[mask], ("accel_x", "gyro_z"))
+        # The client derives the same keys from the mask it sent
+        self.assertEqual(client_mod._mask_keys(mask), ("accel_x", "gyro_z"))
+
+    def test_stale_pending_remove_keeps_hardware_config(self):
+        self.server._process_command(self.conn, {"action": "config_channels", "mask": int(MPUChannel.ACCEL_X)})
+        configs = self.mpu.configs
+        # A broadcast send failure on a connection the selector thread already removed
+        stale, other = socket.socketpair()
+        self.server._pending_remove.add(stale)
+        self.server._drain_pending_remove()
+        self.assertEqual(self.mpu.configs, configs)
+        stale.close()
+        other.close()
+
+    def test_binary_frames_round_trip(self):
+        # Same channel count before and after a config switch; the mask in each header tells them apart
+        old_mask = int(MPUChannel.ACCEL_X | MPUChannel.ACCEL_Y | MPUChannel.GYRO_Z)
+        new_mask = int(MPUChannel.ACCEL_XYZ)
+        old = MPUSocketServerNonBlocking._encode_frames(
+            old_mask, ("accel_x", "accel_y", "gyro_z"), [{"accel_x": 0.5, "accel_y": 1.5, "gyro_z": -2.25}])
+        new = MPUSocketServerNonBlocking._encode_frames(
+            new_mask, ("accel_x", "accel_y", "accel_z"), [{"accel_x": 1.0, "accel_y": 2.0, "accel_z": 8.0}])
+        json_line = b'{"accel_x":3.0,"gyro_z":4.0}\n'
+        stream = old + new + json_line + new[:5]  # ends with a partial frame
+
+        client = client_mod.MPUTestClient("127.0.0.1", 0)
+        client._mixed_framing = True  # as after send_format("binary")
+        client._rxbuf[:len(stream)] = stream
+        consumed = client._split_frames(client._rxbuf, memoryview(client._rxbuf), len(stream))
+        self.assertEqual(consumed, len(old) + len(new) + len(json_line))
+        self.assertEqual(len(client._rx_q), 3)
+
+        # Parse the queued frames as the parse thread would
+        json_packet = client._rx_q.pop()
+        client._rx_event.set()
+        client._parse_loop()
+        self.assertEqual(client.rx_count, 2)
+        self.assertEqual(client._arenas[old_mask], {"accel_x": 0.5, "accel_y": 1.5, "gyro_z": -2.25})
+        self.assertEqual(client.latest, {"accel_x": 1.0, "accel_y": 2.0, "accel_z": 8.0})
+
+        client._rx_q.append(json_packet)
+        client._rx_event.set()
+        client._parse_loop()
+        self.assertEqual(client.rx_count, 3)
+        self.assertEqual(client.latest, {"accel_x": 3.0, "gyro_z": 4.0})
+
+    def test_malformed_lines_are_skipped(self):
+        client = client_mod.MPUTestClient("127.0.0.1", 0)
+        # Plain JSON stream: a leading space must not be mistaken for a binary frame
+        client._rx_q.extend([b' {"accel_x": 1.0}', b"\x05abc", b'{"accel_x": 2.0}'])
+        client._rx_event.set()
+        client._parse_loop()
+        self.assertEqual(client.rx_count, 2)
+        self.assertEqual(client.latest, {"accel_x": 2.0})
+
+        # After switching to binary, a frame whose length does not match its header is dropped
+        client._mixed_framing = True
+        client._rx_q.append(b"\x05abc")
+        client._rx_event.set()
+        client._parse_loop()
+        self.assertEqual(client.rx_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()